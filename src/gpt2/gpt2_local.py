@@ -1,57 +1,285 @@
 import warnings
+import os
 import sys
+import platform
+import queue
+import threading
 warnings.filterwarnings("ignore")  # Suppress warnings
 
+import numpy as np
+import torch
 from transformers import GPT2LMHeadModel, GPT2Tokenizer
+from transformers.pytorch_utils import Conv1D
 
-def load_model(model_name="gpt2"):
-    """Load GPT-2 model and tokenizer"""
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+try:
+    import intel_extension_for_pytorch as ipex
+except ImportError:
+    ipex = None
+
+# Run in BF16 when IPEX is available and the CPU has native AVX512-BF16
+USE_BF16 = ipex is not None and torch.cpu._is_avx512_bf16_supported()
+
+# Numpy dtypes for the input types reported by an onnxruntime session
+ORT_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(int32)": np.int32,
+    "tensor(int64)": np.int64,
+}
+
+def convert_conv1d_to_linear(module):
+    """Swap GPT-2's Conv1D layers for equivalent nn.Linear so they can be quantized"""
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            # Conv1D stores weights as (in, out); nn.Linear expects (out, in)
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            convert_conv1d_to_linear(child)
+    return module
+
+def load_model(model_name="gpt2", onnx_path="gpt2.onnx"):
+    """Load GPT-2 model and tokenizer, preferring an exported ONNX model if present"""
     try:
         print("\nLoading GPT-2 model... (this may take a moment on first run)")
         tokenizer = GPT2Tokenizer.from_pretrained(model_name)
+        
+        # Export with: python -m onnxruntime.transformers.convert_to_onnx -m gpt2
+        #   --model_class GPT2LMHeadModel -p fp32 --optimize_onnx -o gpt2.onnx
+        if onnxruntime is not None and os.path.exists(onnx_path):
+            session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+            print("ONNX model loaded successfully!")
+            return session, tokenizer
+        
         model = GPT2LMHeadModel.from_pretrained(model_name)
+        
+        if USE_BF16:
+            # BF16 weights; ipex.optimize keeps the regular forward used by the decode loop
+            model = ipex.optimize(model.eval(), dtype=torch.bfloat16)
+        else:
+            # Quantize Linear weights to int8 (FBGEMM on x86, QNNPACK on ARM)
+            model = convert_conv1d_to_linear(model)
+            arm = platform.machine().lower() in ['arm64', 'aarch64']
+            torch.backends.quantized.engine = 'qnnpack' if arm else 'fbgemm'
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.eval()
         print("Model loaded successfully!")
         return model, tokenizer
     except Exception as e:
         print(f"Error loading model: {e}")
         sys.exit(1)
 
-def generate_text(prompt, model, tokenizer, max_length=150, is_summary=False):
-    """Generate text based on a prompt"""
+def banned_bigram_tokens(token_ids):
+    """Tokens that would repeat a bigram already in token_ids (no_repeat_ngram_size=2)"""
+    if not token_ids:
+        return []
+    last = token_ids[-1]
+    return [token_ids[i + 1] for i in range(len(token_ids) - 1) if token_ids[i] == last]
+
+def sample_next_token_np(logits, token_ids, temperature, top_k=50, top_p=0.95):
+    """Top-k / top-p sample the next token from a 1-D numpy logits vector"""
+    logits = logits.astype(np.float64) / temperature
+    logits[banned_bigram_tokens(token_ids)] = -np.inf
+    
+    # Keep the top_k logits, highest first
+    top = np.argpartition(-logits, top_k)[:top_k]
+    top = top[np.argsort(-logits[top])]
+    probs = np.exp(logits[top] - logits[top[0]])
+    probs /= probs.sum()
+    
+    # Nucleus: smallest prefix whose cumulative probability reaches top_p
+    keep = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+    probs = probs[:keep] / probs[:keep].sum()
+    return int(np.random.choice(top[:keep], p=probs))
+
+def generate_text_onnx(prompt, session, tokenizer, max_length=150, temperature=0.7):
+    """Generate text with an onnxruntime GPT-2 session, reusing past state each step"""
+    inputs = session.get_inputs()
+    dtypes = {i.name: ORT_DTYPES[i.type] for i in inputs}
+    past_inputs = [i for i in inputs if i.name.startswith("past")]
+    output_names = [o.name for o in session.get_outputs()]
+    
+    # past_* inputs are shaped (2, batch, num_heads, past_seq_len, head_size)
+    _, _, num_heads, _, head_size = past_inputs[0].shape
+    past = {
+        i.name: np.zeros((2, 1, num_heads, 0, head_size), dtype=dtypes[i.name])
+        for i in past_inputs
+    }
+    
+    token_ids = tokenizer.encode(prompt)
+    step_ids = token_ids
+    binding = session.io_binding()
+    
+    while len(token_ids) < max_length:
+        past_length = len(token_ids) - len(step_ids)
+        binding.bind_cpu_input("input_ids", np.array([step_ids], dtype=dtypes["input_ids"]))
+        binding.bind_cpu_input(
+            "position_ids",
+            np.arange(past_length, len(token_ids), dtype=dtypes["position_ids"])[None, :]
+        )
+        binding.bind_cpu_input("attention_mask", np.ones((1, len(token_ids)), dtype=dtypes["attention_mask"]))
+        for name, value in past.items():
+            binding.bind_cpu_input(name, value)
+        for name in output_names:
+            binding.bind_output(name)
+        
+        session.run_with_iobinding(binding)
+        logits, *present = binding.copy_outputs_to_cpu()
+        past = dict(zip(past, present))
+        
+        next_token = sample_next_token_np(logits[0, -1], token_ids, temperature)
+        if next_token == tokenizer.eos_token_id:
+            break
+        token_ids = token_ids + [next_token]
+        step_ids = [next_token]
+    
+    return tokenizer.decode(token_ids, skip_special_tokens=True)
+
+def sample_next_token(logits, token_ids, temperature, top_k=50, top_p=0.95):
+    """Top-k / top-p sample the next token from a 1-D torch logits vector"""
+    logits = logits.float() / temperature
+    banned = banned_bigram_tokens(token_ids)
+    if banned:
+        logits[banned] = float("-inf")
+    
+    # Keep the top_k logits (sorted highest first), then the top_p nucleus of those
+    top_logits, top = torch.topk(logits, top_k)
+    probs = torch.softmax(top_logits, dim=-1)
+    keep = int((torch.cumsum(probs, dim=-1) < top_p).sum()) + 1
+    return int(top[torch.multinomial(probs[:keep], 1)])
+
+def generate_text(prompt, model, tokenizer, max_length=150, is_summary=False, session=None):
+    """Generate text based on a prompt, reusing the session's cached context when the prompt extends it"""
     try:
         # If it's a summary request, modify the prompt
         if is_summary:
             prompt = f"Please summarize the following text:\n{prompt}\n\nSummary:"
         
+        temperature = 0.7 if not is_summary else 0.3  # Lower temperature for summaries
+        if onnxruntime is not None and isinstance(model, onnxruntime.InferenceSession):
+            return generate_text_onnx(prompt, model, tokenizer, max_length, temperature)
+        
         # Encode the input prompt
-        input_ids = tokenizer.encode(prompt, return_tensors="pt")
+        new_ids = tokenizer.encode(prompt)
         
-        # Create attention mask
-        attention_mask = input_ids.new_ones(input_ids.shape)
+        # Each turn is generated from its own prompt; the previous turn's KV cache for this mode
+        # is reused only when this prompt extends that turn's text (prompt plus output)
+        mode = "summary" if is_summary else "generate"
+        state = session.get(mode) if session is not None else None
+        cached = state["token_ids"] if state else []
+        if cached and len(cached) < len(new_ids) and new_ids[:len(cached)] == cached:
+            past = state["past"]
+            pending = new_ids[len(cached) - len(state["pending"]):]  # tokens not yet in past
+        else:
+            past = None
+            pending = new_ids
+        token_ids = list(new_ids)
         
-        # Generate text with different parameters for summaries
-        outputs = model.generate(
-            input_ids,
-            attention_mask=attention_mask,
-            max_length=max_length,
-            num_return_sequences=1,
-            no_repeat_ngram_size=2,
-            do_sample=True,
-            temperature=0.7 if not is_summary else 0.3,  # Lower temperature for summaries
-            top_k=50,
-            top_p=0.95,
-            pad_token_id=tokenizer.eos_token_id
-        )
+        # Decode one token at a time, feeding only the new tokens alongside past_key_values
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+            while True:
+                outputs = model(input_ids=torch.tensor([pending]), past_key_values=past, use_cache=True)
+                past = outputs.past_key_values
+                pending = []
+                
+                next_token = sample_next_token(outputs.logits[0, -1], token_ids, temperature)
+                if next_token == tokenizer.eos_token_id:
+                    break
+                token_ids.append(next_token)
+                pending = [next_token]
+                if len(token_ids) - len(new_ids) >= max_length or len(token_ids) >= model.config.n_positions:
+                    break
+        
+        if session is not None:
+            session[mode] = {"token_ids": token_ids, "past": past, "pending": pending}
         
         # Decode and return the generated text
-        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        generated_text = tokenizer.decode(token_ids, skip_special_tokens=True)
         return generated_text
     except Exception as e:
         return f"Error generating text: {e}"
 
+def generate_text_batch(prompts, model, tokenizer, max_length=150, is_summary=False):
+    """Generate text for several prompts with a single padded generate call"""
+    try:
+        if is_summary:
+            prompts = [f"Please summarize the following text:\n{prompt}\n\nSummary:" for prompt in prompts]
+        
+        temperature = 0.7 if not is_summary else 0.3  # Lower temperature for summaries
+        if onnxruntime is not None and isinstance(model, onnxruntime.InferenceSession):
+            return [generate_text_onnx(prompt, model, tokenizer, max_length, temperature) for prompt in prompts]
+        
+        # Left-pad to the longest prompt so every row ends where generation starts
+        tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+        
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+            outputs = model.generate(
+                inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                max_new_tokens=max(max_length - inputs["input_ids"].shape[1], 1),
+                num_return_sequences=1,
+                no_repeat_ngram_size=2,
+                do_sample=True,
+                temperature=temperature,
+                top_k=50,
+                top_p=0.95,
+                pad_token_id=tokenizer.eos_token_id
+            )
+        
+        return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    except Exception as e:
+        return [f"Error generating text: {e}"] * len(prompts)
+
+def read_prompt_batches(stream, batch_size=8, timeout=0.05):
+    """Yield lists of prompts from a stream, flushing when full or after a short lull"""
+    lines = queue.Queue()
+    
+    def reader():
+        for line in stream:
+            lines.put(line)
+        lines.put(None)
+    
+    threading.Thread(target=reader, daemon=True).start()
+    
+    done = False
+    while not done:
+        batch = []
+        line = lines.get()  # Block until the next prompt arrives
+        while line is not None:
+            if line.strip():
+                batch.append(line.strip())
+            if len(batch) >= batch_size:
+                break
+            try:
+                line = lines.get(timeout=timeout)
+            except queue.Empty:
+                break
+        done = line is None
+        if batch:
+            yield batch
+
 def main():
     # Load model and tokenizer
     model, tokenizer = load_model()
+    session = {}  # Per-mode KV cache of the last turn, reused only by prompts that extend it
+    
+    # Batch mode: treat each line of stdin as a prompt and generate in micro-batches
+    if "--batch" in sys.argv[1:]:
+        for prompts in read_prompt_batches(sys.stdin):
+            for generated_text in generate_text_batch(prompts, model, tokenizer):
+                print(f"\nGenerated text:\n{generated_text}")
+                print("-" * 50)
+        return
     
     print("\nWelcome to GPT-2 Text Generator!")
     print("Type 'quit' or 'exit' to end the program")
@@ -81,7 +309,7 @@ def main():
                 
                 print(f"\nProcessing your " + ("summary" if is_summary else "text generation") + "...")
                 print("-" * 50)
-                generated_text = generate_text(prompt, model, tokenizer, is_summary=is_summary)
+                generated_text = generate_text(prompt, model, tokenizer, is_summary=is_summary, session=session)
                 print(f"\nGenerated " + ("summary" if is_summary else "text") + f":\n{generated_text}")
                 print("-" * 50)
                 
@@ -1,15 +1,32 @@
 import os
-import json
+import re
+import orjson
 import sqlite3
-from datetime import datetime
+from datetime import date, datetime
 from pathlib import Path
 from loguru import logger
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator
 import glob
 
 # Set up logging
 logger.add("imessage_summarizer.log", rotation="1 week")
 
+# Substrings that mark automated messages and reactions
+SKIP_PATTERNS = [
+    'liked', 'emphasized', 'sent you $', 'usps', 'tracking',
+    'duolingo', 'bofa:', 'u.s. post'
+]
+SKIP_RE = re.compile('|'.join(map(re.escape, SKIP_PATTERNS)), re.IGNORECASE)
+
+# Stripped text has at least two words iff it contains any whitespace
+WHITESPACE_RE = re.compile(r'\s')
+
+# Everything that isn't a digit, stripped when normalizing phone numbers
+NON_DIGIT_RE = re.compile(r'\D')
+
+# Seconds from the Unix epoch to 2001-01-01 UTC, the reference date for chat.db timestamps
+APPLE_EPOCH_OFFSET = 978307200
+
 class MessageDatabase:
     def __init__(self):
         # Create database in user's application support directory
@@ -18,12 +35,27 @@ class MessageDatabase:
         
         self.db_path = app_dir / "messages.db"
         self.conn = None
+        self._cursor = None  # Shared cursor for short statements on the hot paths
+        self._contact_index = None  # identifier -> display name, loaded on first lookup
         self.setup_database()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the local database with write-friendly PRAGMAs"""
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+        """)
+        return conn
+
     def setup_database(self):
         """Initialize database with required tables"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = self._connect()
+            self._cursor = self.conn.cursor()
             cursor = self.conn.cursor()
 
             # Create tables
@@ -71,8 +103,12 @@ class MessageDatabase:
                 );
 
                 CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(message_date);
-                CREATE INDEX IF NOT EXISTS idx_messages_contact ON messages(contact_id);
                 CREATE INDEX IF NOT EXISTS idx_messages_processed ON messages(processed_in_summary);
+                CREATE INDEX IF NOT EXISTS idx_messages_contact_date ON messages(contact_id, message_date);
+                CREATE INDEX IF NOT EXISTS idx_messages_contact_processed ON messages(contact_id, processed_in_summary);
+
+                -- Superseded by the composite indexes above, which share its contact_id prefix
+                DROP INDEX IF EXISTS idx_messages_contact;
             """)
 
             self.conn.commit()
@@ -83,7 +119,14 @@ class MessageDatabase:
             raise
 
     def get_contact_name(self, identifier: str) -> str:
-        """Get contact name from macOS Contacts database with retry"""
+        """Get contact name from the preloaded Contacts index"""
+        if self._contact_index is None:
+            self._load_contact_index()
+        return self._contact_index.get(identifier) or identifier
+
+    def _load_contact_index(self):
+        """Build an identifier -> name index from the macOS Contacts database in one pass"""
+        self._contact_index = {}
         try:
             # First try AddressBook path
             contacts_path = os.path.expanduser("~/Library/Application Support/AddressBook/Sources/*/AddressBook-v22.abcddb")
@@ -95,8 +138,8 @@ class MessageDatabase:
                 contacts_db = glob.glob(contacts_path)
                 
             if not contacts_db:
-                logger.warning(f"Could not find Contacts database for {identifier}")
-                return identifier
+                logger.warning("Could not find Contacts database")
+                return
                 
             conn = sqlite3.connect(contacts_db[0])
             cursor = conn.cursor()
@@ -126,62 +169,83 @@ class MessageDatabase:
             ]
             
             for query in queries:
+                is_phone = "ZFULLNUMBER" in query
                 cursor.execute(query)
-                for contact_id, first, last, org in cursor.fetchall():
+                for contact_id, first, last, org in cursor:
                     if contact_id:
-                        if query.find("ZFULLNUMBER") >= 0:
+                        if is_phone:
                             # Format phone number
-                            formatted_id = ''.join(c for c in contact_id if c.isdigit())
+                            formatted_id = NON_DIGIT_RE.sub('', contact_id)
                             if len(formatted_id) == 10:
                                 formatted_id = '+1' + formatted_id
                             elif len(formatted_id) > 10:
                                 formatted_id = '+' + formatted_id
                         else:
                             formatted_id = contact_id
-                            
-                        if formatted_id == identifier:
-                            name = ' '.join(filter(None, [first, last]))
-                            if not name and org:
-                                name = org
-                            return name.strip() if name else identifier
+                        
+                        # First match wins; a record with no name falls back to the identifier
+                        name = ' '.join(filter(None, [first, last]))
+                        if not name and org:
+                            name = org
+                        self._contact_index.setdefault(formatted_id, name.strip() if name else None)
             
             conn.close()
-            return identifier
+            logger.info(f"Loaded {len(self._contact_index)} contact identifiers")
                 
         except Exception as e:
-            logger.error(f"Error getting contact name: {e}")
-            return identifier
+            logger.error(f"Error loading contacts: {e}")
 
     def store_message(self, contact_identifier, message_date, text, is_from_me, chat_id, is_group_chat):
         """Store a single message with contact name resolution"""
+        self.store_messages([{
+            "sender": contact_identifier,
+            "date": message_date,
+            "text": text,
+            "is_from_me": is_from_me,
+            "chat_id": chat_id,
+            "is_group_chat": is_group_chat
+        }])
+
+    def store_messages(self, messages: List[Dict]):
+        """Store a batch of messages and their contacts in a single transaction"""
         try:
-            cursor = self.conn.cursor()
-            
-            # Get contact name
-            display_name = self.get_contact_name(contact_identifier)
-            
-            # First, ensure contact exists
-            cursor.execute("""
-                INSERT OR IGNORE INTO contacts (identifier, display_name, first_seen_date, last_updated)
-                VALUES (?, ?, ?, ?)
-            """, (contact_identifier, display_name, datetime.now(), datetime.now()))
+            cursor = self._cursor
+            now = datetime.now()
             
-            # Get contact_id
-            cursor.execute("SELECT id FROM contacts WHERE identifier = ?", (contact_identifier,))
-            contact_id = cursor.fetchone()[0]
+            # Resolve names before the transaction opens so the Contacts read doesn't hold the write lock
+            if self._contact_index is None:
+                self._load_contact_index()
+            to_name = self._contact_index.get
+            names = {
+                identifier: to_name(identifier) or identifier
+                for identifier in dict.fromkeys(msg["sender"] for msg in messages)
+            }
             
-            # Store message
-            cursor.execute("""
-                INSERT OR IGNORE INTO messages 
-                (contact_id, message_date, text, is_from_me, chat_id, is_group_chat)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (contact_id, message_date, text, is_from_me, chat_id, is_group_chat))
-            
-            self.conn.commit()
+            with self.conn:
+                # Upsert each distinct contact and get its id back in the same statement
+                contact_ids = {}
+                for identifier, display_name in names.items():
+                    cursor.execute("""
+                        INSERT INTO contacts (identifier, display_name, first_seen_date, last_updated)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT(identifier) DO UPDATE SET last_updated = excluded.last_updated
+                        RETURNING id
+                    """, (identifier, display_name, now, now))
+                    contact_ids[identifier] = cursor.fetchone()[0]
+                
+                # Store messages
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO messages 
+                    (contact_id, message_date, text, is_from_me, chat_id, is_group_chat)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (
+                    (contact_ids[msg["sender"]], msg["date"], msg["text"],
+                     msg["is_from_me"], msg["chat_id"], msg["is_group_chat"])
+                    for msg in messages
+                ))
             
         except Exception as e:
-            logger.error(f"Error storing message: {e}")
-            self.conn.rollback()
+            logger.error(f"Error storing messages: {e}")
 
     def get_unprocessed_messages(self, contact_id=None):
         """Get messages that haven't been included in summaries yet"""
@@ -204,26 +268,46 @@ class MessageDatabase:
             logger.error(f"Error fetching unprocessed messages: {e}")
             return []
 
-    def store_weekly_summary(self, contact_id: int, week_start: datetime, week_end: datetime, summary_text: str):
-        """Store a weekly conversation summary"""
+    def iter_unprocessed_by_contact(self) -> Iterator[Tuple]:
+        """Stream (contact_id, display_name, message_id) for unprocessed messages, ordered by contact"""
         try:
             cursor = self.conn.cursor()
             cursor.execute("""
-                INSERT INTO weekly_conversation_summaries 
-                (contact_id, week_start_date, week_end_date, summary_text, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (contact_id, week_start, week_end, summary_text, datetime.now()))
-            self.conn.commit()
-            logger.info(f"Stored weekly summary for contact {contact_id}")
+                SELECT c.id, c.display_name, m.id
+                FROM messages m
+                JOIN contacts c ON m.contact_id = c.id
+                WHERE m.processed_in_summary = FALSE
+                ORDER BY c.id, m.message_date
+            """)
+            yield from cursor
         except Exception as e:
-            logger.error(f"Error storing weekly summary: {e}")
-            self.conn.rollback()
+            logger.error(f"Error fetching unprocessed messages by contact: {e}")
+
+    def store_weekly_summary(self, contact_id: int, week_start: datetime, week_end: datetime, summary_text: str):
+        """Store a weekly conversation summary"""
+        self.store_weekly_summaries([(contact_id, week_start, week_end, summary_text)])
+
+    def store_weekly_summaries(self, summaries: List[Tuple]):
+        """Store (contact_id, week_start, week_end, summary_text) rows in a single transaction"""
+        if not summaries:
+            return
+        try:
+            now = datetime.now()
+            with self.conn:
+                self._cursor.executemany("""
+                    INSERT INTO weekly_conversation_summaries 
+                    (contact_id, week_start_date, week_end_date, summary_text, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, [(*summary, now) for summary in summaries])
+            logger.info(f"Stored {len(summaries)} weekly summaries")
+        except Exception as e:
+            logger.error(f"Error storing weekly summaries: {e}")
 
     def store_identity_summary(self, contact_id, summary_text, personality_traits, 
                              relationship_context, common_topics, confidence_scores):
         """Store an identity summary"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor
             cursor.execute("""
                 INSERT INTO identity_summaries 
                 (contact_id, summary_text, created_at, personality_traits, 
@@ -233,10 +317,10 @@ class MessageDatabase:
                 contact_id, 
                 summary_text, 
                 datetime.now(),
-                json.dumps(personality_traits),
-                json.dumps(relationship_context),
-                json.dumps(common_topics),
-                json.dumps(confidence_scores)
+                orjson.dumps(personality_traits).decode(),
+                orjson.dumps(relationship_context).decode(),
+                orjson.dumps(common_topics).decode(),
+                orjson.dumps(confidence_scores).decode()
             ))
             self.conn.commit()
             logger.info(f"Stored identity summary for contact {contact_id}")
@@ -247,7 +331,7 @@ class MessageDatabase:
     def mark_messages_processed(self, message_ids):
         """Mark messages as processed in summaries"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor
             cursor.executemany("""
                 UPDATE messages 
                 SET processed_in_summary = TRUE 
@@ -266,13 +350,15 @@ class MessageDatabase:
     def get_last_processed_date(self) -> datetime:
         """Get the date of the last processed message"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor
             cursor.execute("""
-                SELECT MAX(message_date) 
+                SELECT message_date
                 FROM messages
+                ORDER BY message_date DESC
+                LIMIT 1
             """)
-            result = cursor.fetchone()[0]
-            return datetime.strptime(result, "%Y-%m-%d %H:%M:%S") if result else None
+            row = cursor.fetchone()
+            return datetime.fromisoformat(row[0]) if row and row[0] else None
         except Exception as e:
             logger.error(f"Error getting last processed date: {e}")
             return None
@@ -280,7 +366,7 @@ class MessageDatabase:
     def get_all_contacts(self) -> List[Dict]:
         """Get all contacts from database"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor
             cursor.execute("""
                 SELECT id, identifier, display_name 
                 FROM contacts
@@ -310,7 +396,7 @@ class MessageDatabase:
             return [
                 {
                     "id": row[0],
-                    "date": datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S"),
+                    "date": datetime.fromisoformat(row[1]),
                     "text": row[2],
                     "is_from_me": bool(row[3]),
                     "chat_id": row[4],
@@ -339,7 +425,7 @@ class MessageDatabase:
             return [
                 {
                     "id": row[0],
-                    "date": datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S"),
+                    "date": datetime.fromisoformat(row[1]),
                     "text": row[2],
                     "is_from_me": bool(row[3]),
                     "chat_id": row[4],
@@ -352,10 +438,48 @@ class MessageDatabase:
             logger.error(f"Error getting all messages for contact: {e}")
             return []
 
+    def get_all_messages_grouped_by_week(self, start_date: datetime = None) -> Iterator[Dict]:
+        """Stream messages ordered by week (starting Monday), then contact, then date"""
+        conn = None
+        try:
+            query = """
+                SELECT date(m.message_date, printf('-%d days', (strftime('%w', m.message_date) + 6) % 7)) AS week_start,
+                       m.contact_id, m.id, m.message_date, m.text, m.is_from_me, m.chat_id, m.is_group_chat,
+                       c.display_name as sender_name
+                FROM messages m
+                JOIN contacts c ON m.contact_id = c.id
+            """
+            params = []
+            if start_date:
+                query += " WHERE m.message_date >= ?"
+                params.append(start_date)
+            query += " ORDER BY week_start, m.contact_id, m.message_date"
+            
+            # Dedicated read connection: under WAL, summaries can be stored through self.conn
+            # while rows are still streaming, and the stream can be consumed from another thread
+            conn = self._connect()
+            for row in conn.execute(query, params):
+                yield {
+                    "week_start": date.fromisoformat(row[0]),
+                    "contact_id": row[1],
+                    "id": row[2],
+                    "date": datetime.fromisoformat(row[3]),
+                    "text": row[4],
+                    "is_from_me": bool(row[5]),
+                    "chat_id": row[6],
+                    "is_group_chat": bool(row[7]),
+                    "sender": "Me" if bool(row[5]) else row[8]
+                }
+        except Exception as e:
+            logger.error(f"Error getting messages grouped by week: {e}")
+        finally:
+            if conn:
+                conn.close()
+
     def get_latest_identity_summary(self, contact_id: int) -> Dict:
         """Get the most recent identity summary for a contact"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor
             cursor.execute("""
                 SELECT id, summary_text, personality_traits, relationship_context, 
                        common_topics, created_at
@@ -370,10 +494,10 @@ class MessageDatabase:
                 return {
                     "id": row[0],
                     "summary_text": row[1],
-                    "personality_traits": json.loads(row[2]),
-                    "relationship_context": json.loads(row[3]),
-                    "common_topics": json.loads(row[4]),
-                    "created_at": datetime.strptime(row[5], "%Y-%m-%d %H:%M:%S")
+                    "personality_traits": orjson.loads(row[2]),
+                    "relationship_context": orjson.loads(row[3]),
+                    "common_topics": orjson.loads(row[4]),
+                    "created_at": datetime.fromisoformat(row[5])
                 }
             return None
         except Exception as e:
@@ -388,13 +512,10 @@ class MessageDatabase:
                 logger.error("Messages database not found")
                 return "Error: Messages database not found", []
 
-            imessage_conn = sqlite3.connect(messages_db)
-            cursor = imessage_conn.cursor()
-            
             # Base query
             query = """
                 SELECT 
-                    datetime(message.date/1000000000 + strftime("%s", "2001-01-01"), "unixepoch", "localtime") as message_date,
+                    message.date,
                     message.text,
                     CASE 
                         WHEN message.is_from_me = 1 THEN 'Me'
@@ -412,54 +533,66 @@ class MessageDatabase:
                 AND length(message.text) > 0
             """
             
-            # Add start_date filter if provided
-            params = []
+            # Skip automated messages and reactions in SQL (LIKE is case-insensitive for ASCII)
+            query += " AND message.text NOT LIKE ?" * len(SKIP_PATTERNS)
+            params = [f"%{skip_text}%" for skip_text in SKIP_PATTERNS]
+            
+            # Add start_date filter if provided, compared on the raw column so chat.db's date index applies.
+            # Dates are kept to the second, so "after start_date" means from the next whole second on
             if start_date:
-                query += " AND datetime(message.date/1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime') > ?"
-                params.append(start_date.strftime("%Y-%m-%d %H:%M:%S"))
+                query += " AND message.date >= ?"
+                params.append((int(start_date.timestamp()) + 1 - APPLE_EPOCH_OFFSET) * 1_000_000_000)
 
-            query += " ORDER BY chat.ROWID, message_date ASC"
-            
-            cursor.execute(query, params)
-            messages = cursor.fetchall()
+            query += " ORDER BY chat.ROWID, message.date ASC"
             
             # Process messages
             processed_messages = []
-            conversation_text = "Multiple conversations:\n\n"
+            conversation_parts = ["Multiple conversations:\n\n"]
+            current_chat = None
             
-            for msg in messages:
-                try:
-                    msg_date = datetime.strptime(msg[0], "%Y-%m-%d %H:%M:%S")
-                    text = str(msg[1]).strip()
-                    sender = msg[2]
-                    is_from_me = bool(msg[3])
-                    chat_id = msg[4]
-                    chat_name = msg[5] if msg[5] else chat_id
-                    
-                    # Skip automated messages and reactions
-                    if any(skip_text in text.lower() for skip_text in [
-                        'liked', 'emphasized', 'sent you $', 'usps', 'tracking',
-                        'duolingo', 'bofa:', 'u.s. post'
-                    ]) or len(text.split()) < 2:
+            imessage_conn = sqlite3.connect(messages_db)
+            imessage_conn.execute("PRAGMA cache_size=-65536")
+            imessage_conn.execute("PRAGMA mmap_size=268435456")
+            try:
+                # Iterate the cursor directly so rows stream instead of materializing at once
+                cursor = imessage_conn.execute(query, params)
+                for msg in cursor:
+                    try:
+                        text = str(msg[1]).strip()
+                        
+                        # Skip automated messages the SQL filter can't catch, and single-word messages (any Unicode whitespace splits words)
+                        if SKIP_RE.search(text) or not WHITESPACE_RE.search(text):
+                            continue
+                        
+                        # Nanoseconds since 2001 -> local time, truncated to the second
+                        msg_date = datetime.fromtimestamp(msg[0] // 1_000_000_000 + APPLE_EPOCH_OFFSET)
+                        sender = msg[2]
+                        is_from_me = bool(msg[3])
+                        chat_id = msg[4]
+                        chat_name = msg[5] if msg[5] else chat_id
+                        
+                        processed_messages.append({
+                            "date": msg_date,
+                            "text": text,
+                            "sender": sender,
+                            "is_from_me": is_from_me,
+                            "chat_id": chat_id,
+                            "is_group_chat": bool(chat_name != chat_id)
+                        })
+                        
+                        # Rows arrive grouped by chat, so each chat gets one header
+                        if chat_id != current_chat:
+                            conversation_parts.append(f"Chat with {chat_name}:\n")
+                            current_chat = chat_id
+                        conversation_parts.append(f"{sender}: {text}\n")
+                        
+                    except Exception as e:
+                        logger.error(f"Error processing message: {e}")
                         continue
-                    
-                    processed_messages.append({
-                        "date": msg_date,
-                        "text": text,
-                        "sender": sender,
-                        "is_from_me": is_from_me,
-                        "chat_id": chat_id,
-                        "is_group_chat": bool(chat_name != chat_id)
-                    })
-                    
-                    conversation_text += f"Chat with {chat_name}:\n"
-                    conversation_text += f"{sender}: {text}\n"
-                    
-                except Exception as e:
-                    logger.error(f"Error processing message: {e}")
-                    continue
+            finally:
+                imessage_conn.close()
             
-            imessage_conn.close()
+            conversation_text = "".join(conversation_parts)
             
             if not processed_messages:
                 return "No messages found in the specified time period.", []
@@ -496,7 +629,8 @@ class MessageDatabase:
             temp_conn.close()
             
             # Reopen main connection
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = self._connect()
+            self._cursor = self.conn.cursor()
             logger.info("Database optimized successfully")
             
         except Exception as e:
@@ -505,13 +639,16 @@ class MessageDatabase:
     def get_earliest_message_date(self) -> datetime:
         """Get the date of the earliest message in the database"""
         try:
-            cursor = self.conn.cursor()
+            cursor = self._cursor
             cursor.execute("""
-                SELECT MIN(message_date)
+                SELECT message_date
                 FROM messages
+                WHERE message_date IS NOT NULL
+                ORDER BY message_date ASC
+                LIMIT 1
             """)
-            result = cursor.fetchone()[0]
-            return datetime.strptime(result, "%Y-%m-%d %H:%M:%S") if result else None
+            row = cursor.fetchone()
+            return datetime.fromisoformat(row[0]) if row and row[0] else None
         except Exception as e:
             logger.error(f"Error getting earliest message date: {e}")
             return None
@@ -1,9 +1,12 @@
-import json
+import orjson
 import sqlite3
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, List
 
+# Contacts whose summaries are exported as examples (family, friend, professional)
+EXAMPLE_CONTACTS = ['Mom', 'Dad', 'Sebastian', 'Tim Tran', 'Professor Loessi']
+
 def get_database_path() -> Path:
     """Get path to the messages database"""
     return Path.home() / "Library" / "Application Support" / "iMessage-Summarizer" / "messages.db"
@@ -13,6 +16,7 @@ def export_summaries() -> Dict:
     db_path = get_database_path()
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    placeholders = ", ".join("?" * len(EXAMPLE_CONTACTS))
     
     # Get example summaries
     data = {
@@ -27,7 +31,7 @@ def export_summaries() -> Dict:
     }
     
     # Get a few interesting weekly summaries (family, friend, professional)
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT DISTINCT
             c.display_name,
             w.week_start_date,
@@ -36,11 +40,11 @@ def export_summaries() -> Dict:
             w.created_at
         FROM weekly_conversation_summaries w
         JOIN contacts c ON w.contact_id = c.id
-        WHERE c.display_name IN ('Mom', 'Dad', 'Sebastian', 'Tim Tran', 'Professor Loessi')
+        WHERE c.display_name IN ({placeholders})
         AND length(w.summary_text) > 100
         ORDER BY w.created_at DESC
         LIMIT 5
-    """)
+    """, EXAMPLE_CONTACTS)
     
     for row in cursor.fetchall():
         data["example_weekly_summaries"].append({
@@ -52,7 +56,7 @@ def export_summaries() -> Dict:
         })
     
     # Get identity summaries for the same contacts
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT 
             c.display_name,
             i.summary_text,
@@ -63,35 +67,32 @@ def export_summaries() -> Dict:
             i.created_at
         FROM identity_summaries i
         JOIN contacts c ON i.contact_id = c.id
-        WHERE c.display_name IN ('Mom', 'Dad', 'Sebastian', 'Tim Tran', 'Professor Loessi')
+        WHERE c.display_name IN ({placeholders})
         ORDER BY i.created_at DESC
         LIMIT 5
-    """)
+    """, EXAMPLE_CONTACTS)
     
     for row in cursor.fetchall():
         data["example_identity_summaries"].append({
             "contact": row[0],
             "summary": row[1],
-            "personality_traits": json.loads(row[2]) if row[2] else {},
-            "relationship_context": json.loads(row[3]) if row[3] else {},
-            "common_topics": json.loads(row[4]) if row[4] else {},
-            "confidence_scores": json.loads(row[5]) if row[5] else {},
+            "personality_traits": orjson.loads(row[2]) if row[2] else {},
+            "relationship_context": orjson.loads(row[3]) if row[3] else {},
+            "common_topics": orjson.loads(row[4]) if row[4] else {},
+            "confidence_scores": orjson.loads(row[5]) if row[5] else {},
             "created_at": row[6]
         })
     
-    # Get metadata
-    cursor.execute("SELECT COUNT(DISTINCT id) FROM contacts")
-    data["metadata"]["total_contacts"] = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM messages")
-    data["metadata"]["total_messages"] = cursor.fetchone()[0]
+    # Get metadata in a single round trip
+    cursor.execute("SELECT (SELECT COUNT(*) FROM contacts), (SELECT COUNT(*) FROM messages)")
+    data["metadata"]["total_contacts"], data["metadata"]["total_messages"] = cursor.fetchone()
     
     conn.close()
     
     # Export to file
     output_path = Path("summary_examples.json")
-    with open(output_path, 'w') as f:
-        json.dump(data, f, indent=2)
+    with open(output_path, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
     
     return data
 
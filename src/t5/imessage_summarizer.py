@@ -1,8 +1,12 @@
 # pyright: ignore-errors
 
 import os
+import queue
+import threading
 import warnings
-from datetime import datetime, timedelta
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
 from loguru import logger
 from database import MessageDatabase
 from summarizer_utils import MessageSummarizer
@@ -36,6 +40,9 @@ class MessageProcessor:
             # Update identity summaries
             self._update_identity_summaries()
 
+            # Persist summaries cached during this run
+            self.summarizer.save_caches()
+
             # Optimize database
             self.db.optimize_database()
 
@@ -64,15 +71,7 @@ class MessageProcessor:
 
             if messages:
                 # Store new messages in our database
-                for msg in messages:
-                    self.db.store_message(
-                        contact_identifier=msg["sender"],
-                        message_date=msg["date"],
-                        text=msg["text"],
-                        is_from_me=msg["is_from_me"],
-                        chat_id=msg["chat_id"],
-                        is_group_chat=msg["is_group_chat"]
-                    )
+                self.db.store_messages(messages)
                 logger.info(f"Stored {len(messages)} new messages")
                 return True
 
@@ -85,27 +84,16 @@ class MessageProcessor:
     def _process_messages_by_contact(self):
         """Process messages grouped by contact"""
         try:
-            contacts = self.db.get_all_contacts()
-
-            for contact in contacts:
-                unprocessed = self.db.get_unprocessed_messages(contact["id"])
-                if unprocessed:
-                    logger.info(f"Processing messages for contact: {contact['display_name']}")
-
-                    # Convert tuple to dict for processing
-                    messages = [
-                        {
-                            "id": msg[0],
-                            "message_date": msg[2],
-                            "text": msg[3],
-                            "is_from_me": msg[4],
-                            "chat_id": msg[5]
-                        }
-                        for msg in unprocessed
-                    ]
+            # One query for every contact's unprocessed messages, grouped here instead of per contact
+            processed_ids = []
+            unprocessed = self.db.iter_unprocessed_by_contact()
+            for (contact_id, display_name), rows in groupby(unprocessed, key=itemgetter(0, 1)):
+                logger.info(f"Processing messages for contact: {display_name}")
+                processed_ids.extend(row[2] for row in rows)
 
-                    # Mark messages as processed
-                    self.db.mark_messages_processed([msg["id"] for msg in messages])
+            # Mark messages as processed in a single transaction
+            if processed_ids:
+                self.db.mark_messages_processed(processed_ids)
 
         except Exception as e:
             logger.error(f"Error processing messages by contact: {e}")
@@ -113,7 +101,7 @@ class MessageProcessor:
     def _generate_weekly_summaries(self):
         """Generate weekly summaries for each contact"""
         try:
-            contacts = self.db.get_all_contacts()
+            contacts = {contact["id"]: contact for contact in self.db.get_all_contacts()}
             
             # Get earliest message date
             earliest_date = self.db.get_earliest_message_date()
@@ -123,41 +111,76 @@ class MessageProcessor:
             
             logger.info(f"Generating weekly summaries from {earliest_date} to now")
             
-            # Generate summaries week by week from earliest date
-            current_date = datetime.now().date()
-            week_start = earliest_date.date() - timedelta(days=earliest_date.weekday())
-            
-            while week_start <= current_date:
+            # Upcoming weeks are read on a background thread while the current one is summarized
+            for week_start, week_contacts, week_messages in self._prefetch_weeks(contacts):
                 week_end = week_start + timedelta(days=7)
                 logger.info(f"Processing week: {week_start} to {week_end}")
                 
-                for contact in contacts:
-                    messages = self.db.get_messages_for_timeframe(
-                        contact["id"],
-                        start_date=week_start,
-                        end_date=week_end
-                    )
-                    
-                    if messages:
-                        logger.info(f"Found {len(messages)} messages for {contact['display_name']} in week {week_start}")
-                        summary = self.summarizer.generate_weekly_summary(messages)
-                        
-                        if summary:
-                            logger.info(f"Generated summary for {contact['display_name']}: {summary[:100]}...")
-                            self.db.store_weekly_summary(
-                                contact["id"],
-                                week_start,
-                                week_end,
-                                summary
-                            )
-                        else:
-                            logger.warning(f"No summary generated for {contact['display_name']}")
-                            
-                week_start = week_end
+                for contact, messages in zip(week_contacts, week_messages):
+                    logger.info(f"Found {len(messages)} messages for {contact['display_name']} in week {week_start}")
+                
+                # Summarize every contact's conversation for the week as a batch
+                summaries = self.summarizer.generate_weekly_summary_batch(
+                    week_messages, [contact["id"] for contact in week_contacts]
+                )
+                
+                rows = []
+                for contact, summary in zip(week_contacts, summaries):
+                    if summary:
+                        logger.info(f"Generated summary for {contact['display_name']}: {summary[:100]}...")
+                        rows.append((contact["id"], week_start, week_end, summary))
+                    else:
+                        logger.warning(f"No summary generated for {contact['display_name']}")
+                
+                self.db.store_weekly_summaries(rows)
 
         except Exception as e:
             logger.error(f"Error generating weekly summaries: {e}")
 
+    def _prefetch_weeks(self, contacts, maxsize=4):
+        """Yield (week_start, contacts, conversations) per week, read up to maxsize weeks ahead"""
+        weeks = queue.Queue(maxsize=maxsize)
+        stop = threading.Event()  # Set when the consumer is done, even if it stopped early
+        
+        def put(item):
+            """Queue an item, giving up once the consumer has stopped"""
+            while not stop.is_set():
+                try:
+                    weeks.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def producer():
+            messages_by_week = None
+            try:
+                # One pass over all messages, already ordered by week and then contact
+                messages_by_week = self.db.get_all_messages_grouped_by_week()
+                for week_start, week_rows in groupby(messages_by_week, key=itemgetter("week_start")):
+                    week_contacts = []
+                    week_messages = []
+                    for contact_id, messages in groupby(week_rows, key=itemgetter("contact_id")):
+                        week_contacts.append(contacts[contact_id])
+                        week_messages.append(list(messages))
+                    if not put((week_start, week_contacts, week_messages)):
+                        break
+            except Exception as e:
+                logger.error(f"Error reading messages by week: {e}")
+            finally:
+                # Close the read connection now rather than whenever the generator is collected
+                if messages_by_week is not None:
+                    messages_by_week.close()
+                put(None)
+        
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            yield from iter(weeks.get, None)
+        finally:
+            stop.set()
+            thread.join()
+
     def _update_identity_summaries(self):
         """Update identity summaries for each contact"""
         try:
@@ -173,7 +196,8 @@ class MessageProcessor:
 
                     summary, analysis = self.summarizer.generate_identity_summary(
                         messages,
-                        previous_summary["summary_text"] if previous_summary else None
+                        previous_summary["summary_text"] if previous_summary else None,
+                        contact_id=contact["id"]
                     )
 
                     if summary and analysis:
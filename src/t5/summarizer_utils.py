@@ -1,111 +1,183 @@
 import json
 from datetime import datetime, timedelta
+from pathlib import Path
 from typing import List, Dict, Tuple
 from loguru import logger
+import torch
 from transformers import (
     AutoTokenizer, 
     AutoModelForSeq2SeqLM, 
-    AutoModelForSequenceClassification,
-    pipeline
+    AutoModelForSequenceClassification
 )
+from summary_cache import SummaryCache
+
+# Candidate labels for zero-shot analysis
+PERSONALITY_TRAITS = [
+    "friendly", "professional", "formal", "casual", "emotional",
+    "analytical", "supportive", "demanding", "humorous", "serious"
+]
+RELATIONSHIP_CONTEXTS = [
+    "close friend", "family member", "professional contact",
+    "acquaintance", "romantic interest", "mentor/mentee"
+]
+CONVERSATION_TOPICS = [
+    "work", "family", "hobbies", "travel", "food",
+    "entertainment", "sports", "technology", "education",
+    "personal life", "future plans", "shared memories"
+]
+
+# Same hypothesis the zero-shot-classification pipeline uses
+HYPOTHESIS_TEMPLATE = "This example is {}."
 
 class MessageSummarizer:
     def __init__(self):
         logger.info("Initializing summarization models...")
         
+        # fp16 on GPU; on CPU, bf16 where supported natively
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if self.device.type == "cuda":
+            dtype = torch.float16
+        else:
+            dtype = torch.bfloat16 if torch.cpu._is_avx512_bf16_supported() else torch.float32
+        
         # Load conversation summarization model
         self.conv_tokenizer = AutoTokenizer.from_pretrained("philschmid/bart-large-cnn-samsum")
-        self.conv_model = AutoModelForSeq2SeqLM.from_pretrained("philschmid/bart-large-cnn-samsum")
+        self.conv_model = AutoModelForSeq2SeqLM.from_pretrained(
+            "philschmid/bart-large-cnn-samsum", torch_dtype=dtype
+        ).to(self.device).eval()
         
         # Load personality analysis model
         self.personality_tokenizer = AutoTokenizer.from_pretrained("facebook/bart-large-mnli")
-        self.personality_model = AutoModelForSequenceClassification.from_pretrained("facebook/bart-large-mnli")
+        self.personality_model = AutoModelForSequenceClassification.from_pretrained(
+            "facebook/bart-large-mnli", torch_dtype=dtype
+        ).to(self.device).eval()
+        
+        # Label ids used to turn NLI logits into zero-shot scores
+        label2id = {label.lower(): i for label, i in self.personality_model.config.label2id.items()}
+        self.entailment_id = next(i for label, i in label2id.items() if label.startswith("entail"))
+        self.contradiction_id = -1 if self.entailment_id == 0 else 0
+        
+        # Fuse kernels with torch.compile on GPU. Compiling forward keeps generate() usable, but
+        # there it only covers decoder steps: generate() calls the encoder via get_encoder(),
+        # so the summarizer's encoder is compiled separately
+        if self.device.type == "cuda":
+            for module in (self.conv_model, self.conv_model.get_encoder(), self.personality_model):
+                module.forward = torch.compile(module.forward, dynamic=True)
         
-        # Create personality analysis pipeline
-        self.personality_pipeline = pipeline(
-            "zero-shot-classification",
-            model="facebook/bart-large-mnli",
-            tokenizer="facebook/bart-large-mnli"
-        )
+        # Caches of generated summaries, stored alongside the message database
+        cache_dir = Path.home() / "Library" / "Application Support" / "iMessage-Summarizer"
+        self.weekly_cache = SummaryCache(cache_dir / "weekly_summary_cache")
+        self.identity_cache = SummaryCache(cache_dir / "identity_summary_cache")
         
         logger.info("Models loaded successfully")
 
-    def generate_weekly_summary(self, messages: List[Dict]) -> str:
+    def save_caches(self):
+        """Persist the summary caches"""
+        self.weekly_cache.save()
+        self.identity_cache.save()
+
+    def generate_weekly_summary(self, messages: List[Dict], contact_id: int = None) -> str:
         """Generate a summary of conversations for a week"""
+        return self.generate_weekly_summary_batch([messages], [contact_id])[0]
+
+    @torch.inference_mode()
+    def generate_weekly_summary_batch(self, message_groups: List[List[Dict]], contact_ids: List[int] = None,
+                                      batch_size: int = 8, max_length_ratio: float = 1.3) -> List[str]:
+        """Generate weekly summaries for several conversations, batching similar lengths together"""
         try:
-            # Format messages for summarization
-            conversation = self._format_messages_for_summary(messages)
-            
-            # Generate summary
-            inputs = self.conv_tokenizer(
-                conversation,
-                max_length=1024,
-                truncation=True,
-                padding="longest",
-                return_tensors="pt"
-            )
+            # Reuse cached summaries for the same contact's identical conversation
+            contact_ids = contact_ids or [None] * len(message_groups)
+            conversations = [self._format_messages_for_summary(messages) for messages in message_groups]
+            summaries = self.weekly_cache.lookup(contact_ids, conversations)
+            misses = [i for i, summary in enumerate(summaries) if summary is None]
             
-            summary_ids = self.conv_model.generate(
-                inputs["input_ids"],
-                max_length=500,  # 500 words as requested
-                min_length=200,
-                num_beams=4,
-                length_penalty=2.0,
-                early_stopping=True
-            )
+            # Tokenize the rest up front
+            encoded = {}
+            if misses:
+                tokenized = self.conv_tokenizer([conversations[i] for i in misses], max_length=1024, truncation=True)
+                encoded = dict(zip(misses, tokenized["input_ids"]))
             
-            summary = self.conv_tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-            return summary
+            # Sort by token count so each batch carries as little padding as possible
+            order = sorted(misses, key=lambda i: len(encoded[i]))
+            
+            for batch in self._length_buckets(order, encoded, batch_size, max_length_ratio):
+                inputs = self.conv_tokenizer.pad(
+                    {"input_ids": [encoded[i] for i in batch]},
+                    return_tensors="pt"
+                )
+                
+                summary_ids = self.conv_model.generate(
+                    inputs["input_ids"].to(self.device),
+                    attention_mask=inputs["attention_mask"].to(self.device),
+                    max_length=500,  # 500 words as requested
+                    min_length=200,
+                    num_beams=4,
+                    length_penalty=2.0,
+                    early_stopping=True
+                )
+                
+                decoded = self.conv_tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+                for i, summary in zip(batch, decoded):
+                    summaries[i] = summary
+            
+            generated = [i for i in misses if summaries[i]]
+            self.weekly_cache.add(
+                [contact_ids[i] for i in generated],
+                [conversations[i] for i in generated],
+                [summaries[i] for i in generated]
+            )
+            return summaries
             
         except Exception as e:
-            logger.error(f"Error generating weekly summary: {e}")
-            return ""
+            logger.error(f"Error generating weekly summaries: {e}")
+            return [""] * len(message_groups)
 
+    def _length_buckets(self, order: List[int], encoded: Dict[int, List[int]], batch_size: int,
+                        max_length_ratio: float) -> List[List[int]]:
+        """Split length-sorted ids into batches whose longest input is within max_length_ratio of the shortest"""
+        buckets = []
+        for i in order:
+            bucket = buckets[-1] if buckets else None
+            if (bucket is None or len(bucket) >= batch_size
+                    or len(encoded[i]) > max_length_ratio * len(encoded[bucket[0]])):
+                buckets.append([i])
+            else:
+                bucket.append(i)
+        return buckets
+
+    @torch.inference_mode()
     def analyze_personality(self, messages: List[Dict]) -> Dict:
         """Analyze personality traits and relationship dynamics"""
         try:
             # Combine messages for analysis
-            text = " ".join([msg["text"] for msg in messages])
-            
-            # Personality traits to analyze
-            traits = [
-                "friendly", "professional", "formal", "casual", "emotional",
-                "analytical", "supportive", "demanding", "humorous", "serious"
-            ]
-            
-            # Relationship contexts to analyze
-            contexts = [
-                "close friend", "family member", "professional contact",
-                "acquaintance", "romantic interest", "mentor/mentee"
-            ]
-            
-            # Analyze personality traits
-            trait_results = self.personality_pipeline(
-                text,
-                candidate_labels=traits,
-                multi_label=True
-            )
+            text = self._format_messages_for_analysis(messages)
             
-            # Analyze relationship context
-            context_results = self.personality_pipeline(
-                text,
-                candidate_labels=contexts,
-                multi_label=False
-            )
+            # Score traits, relationship contexts and topics in one batched NLI pass
+            labels = PERSONALITY_TRAITS + RELATIONSHIP_CONTEXTS + CONVERSATION_TOPICS
+            logits = self._entailment_logits(text, labels)
+            n_traits, n_contexts = len(PERSONALITY_TRAITS), len(RELATIONSHIP_CONTEXTS)
             
-            # Extract common topics
-            topics = self._extract_common_topics(messages)
+            # Traits and topics are multi-label: entailment vs contradiction for each label
+            label_scores = logits.softmax(dim=-1)[:, 1]
+            trait_scores = label_scores[:n_traits]
+            topic_scores = label_scores[n_traits + n_contexts:]
+            
+            # Relationship context is single-label: entailment softmaxed across the contexts
+            context_scores = logits[n_traits:n_traits + n_contexts, 1].softmax(dim=-1)
+            context, context_score = self._rank_labels(RELATIONSHIP_CONTEXTS, context_scores)[0]
             
             return {
                 "personality_traits": {
-                    label: score 
-                    for label, score in zip(trait_results["labels"], trait_results["scores"])
+                    label: score
+                    for label, score in self._rank_labels(PERSONALITY_TRAITS, trait_scores)
                     if score > 0.5  # Only include confident predictions
                 },
-                "relationship_context": {
-                    context_results["labels"][0]: context_results["scores"][0]
-                },
-                "common_topics": topics
+                "relationship_context": {context: context_score},
+                "common_topics": {
+                    label: score
+                    for label, score in self._rank_labels(CONVERSATION_TOPICS, topic_scores)
+                    if score > 0.3  # Include topics with reasonable confidence
+                }
             }
             
         except Exception as e:
@@ -116,6 +188,25 @@ class MessageSummarizer:
                 "common_topics": {}
             }
 
+    def _entailment_logits(self, text: str, labels: List[str], batch_size: int = 16) -> torch.Tensor:
+        """(contradiction, entailment) logits for text against a hypothesis per candidate label"""
+        logits = []
+        for start in range(0, len(labels), batch_size):
+            batch = labels[start:start + batch_size]
+            inputs = self.personality_tokenizer(
+                [text] * len(batch),
+                [HYPOTHESIS_TEMPLATE.format(label) for label in batch],
+                truncation="only_first",
+                padding=True,
+                return_tensors="pt"
+            ).to(self.device)
+            logits.append(self.personality_model(**inputs).logits.float())
+        return torch.cat(logits)[:, [self.contradiction_id, self.entailment_id]]
+
+    def _rank_labels(self, labels: List[str], scores: torch.Tensor) -> List[Tuple[str, float]]:
+        """Pair labels with their scores, highest first"""
+        return sorted(zip(labels, scores.tolist()), key=lambda pair: pair[1], reverse=True)
+
     def _format_messages_for_summary(self, messages: List[Dict]) -> str:
         """Format messages for the summarization model"""
         formatted = []
@@ -124,42 +215,16 @@ class MessageSummarizer:
             formatted.append(f"{sender}: {msg['text']}")
         return "\n".join(formatted)
 
-    def _format_messages_for_analysis(self, messages: List[Dict]) -> str:
+    def _format_messages_for_analysis(self, messages: List[Dict], recent: int = 500, max_chars: int = 8000) -> str:
         """Format messages for personality analysis"""
-        # Combine all messages with context
-        return " ".join([msg["text"] for msg in messages])
-
-    def _extract_common_topics(self, messages: List[Dict]) -> Dict[str, float]:
-        """Extract and score common conversation topics"""
-        try:
-            # Common topics to look for
-            topics = [
-                "work", "family", "hobbies", "travel", "food",
-                "entertainment", "sports", "technology", "education",
-                "personal life", "future plans", "shared memories"
-            ]
-            
-            # Combine messages
-            text = self._format_messages_for_analysis(messages)
-            
-            # Analyze topics
-            results = self.personality_pipeline(
-                text,
-                candidate_labels=topics,
-                multi_label=True
-            )
-            
-            return {
-                label: score 
-                for label, score in zip(results["labels"], results["scores"])
-                if score > 0.3  # Include topics with reasonable confidence
-            }
-            
-        except Exception as e:
-            logger.error(f"Error extracting topics: {e}")
-            return {}
+        # The NLI model only reads the first 1024 tokens, so keep the most recent messages,
+        # newest first and without repeats, and stop well past what it can consume
+        texts = dict.fromkeys(msg["text"] for msg in reversed(messages[-recent:]))
+        return " ".join(texts)[:max_chars]
 
-    def generate_identity_summary(self, messages: List[Dict], previous_summary: str = None) -> Tuple[str, Dict]:
+    @torch.inference_mode()
+    def generate_identity_summary(self, messages: List[Dict], previous_summary: str = None,
+                                  contact_id: int = None) -> Tuple[str, Dict]:
         """Generate or update identity summary with confidence scores"""
         try:
             # Analyze personality and get confidence score
@@ -176,29 +241,36 @@ class MessageSummarizer:
             if previous_summary:
                 prompt = f"Previous summary: {previous_summary}\nNew analysis: {prompt}"
             
-            # Generate narrative summary
-            inputs = self.conv_tokenizer(
-                prompt,
-                max_length=1024,
-                truncation=True,
-                return_tensors="pt"
-            )
-            
-            summary_ids = self.conv_model.generate(
-                inputs["input_ids"],
-                max_length=300,
-                min_length=100,
-                num_beams=4,
-                length_penalty=2.0,
-                early_stopping=True
-            )
-            
-            summary = self.conv_tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+            # Reuse this contact's cached summary for an identical prompt, otherwise generate one
+            summary = self.identity_cache.lookup([contact_id], [prompt])[0]
+            if summary is None:
+                inputs = self.conv_tokenizer(
+                    prompt,
+                    max_length=1024,
+                    truncation=True,
+                    return_tensors="pt"
+                )
+                
+                # Greedy decoding: the prompt is short and templated, beams add little
+                summary_ids = self.conv_model.generate(
+                    inputs["input_ids"].to(self.device),
+                    max_new_tokens=200,
+                    min_length=100,
+                    num_beams=1,
+                    do_sample=False,
+                    use_cache=True
+                )
+                
+                summary = self.conv_tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+                if summary:
+                    self.identity_cache.add([contact_id], [prompt], [summary])
             
             # Add confidence scores to analysis
-            analysis["personality_confidence"] = sum(analysis["personality_traits"].values()) / len(analysis["personality_traits"])
+            # Short chats can leave no trait or topic above threshold
+            traits, topics = analysis["personality_traits"], analysis["common_topics"]
+            analysis["personality_confidence"] = sum(traits.values()) / len(traits) if traits else 0.0
             analysis["relationship_confidence"] = list(analysis["relationship_context"].values())[0]
-            analysis["topics_confidence"] = sum(analysis["common_topics"].values()) / len(analysis["common_topics"])
+            analysis["topics_confidence"] = sum(topics.values()) / len(topics) if topics else 0.0
             
             return summary, analysis
             
@@ -0,0 +1,43 @@
+import hashlib
+from pathlib import Path
+from typing import Hashable, List, Optional
+
+import orjson
+from loguru import logger
+
+class SummaryCache:
+    """Reuse generated summaries for inputs already summarized for the same key"""
+
+    def __init__(self, path: Path):
+        self.path = path.with_suffix(".json")
+
+        # "<key>:<sha256 of input>" -> summary
+        self.entries = {}
+        if self.path.exists():
+            try:
+                entries = orjson.loads(self.path.read_bytes())
+                if isinstance(entries, dict):
+                    self.entries = entries
+                    logger.info(f"Loaded {len(self.entries)} cached summaries from {self.path.name}")
+            except Exception as e:
+                logger.error(f"Error loading summary cache: {e}")
+
+    def _key(self, key: Hashable, text: str) -> str:
+        """Cache key for a key (e.g. contact id) and the exact input text"""
+        return f"{key}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+    def lookup(self, keys: List[Hashable], texts: List[str]) -> List[Optional[str]]:
+        """Return the cached summary for each text, or None on a miss"""
+        return [self.entries.get(self._key(key, text)) for key, text in zip(keys, texts)]
+
+    def add(self, keys: List[Hashable], texts: List[str], summaries: List[str]):
+        """Cache summaries under their key and input hash"""
+        for key, text, summary in zip(keys, texts, summaries):
+            self.entries[self._key(key, text)] = summary
+
+    def save(self):
+        """Persist the entries to disk"""
+        try:
+            self.path.write_bytes(orjson.dumps(self.entries))
+        except Exception as e:
+            logger.error(f"Error saving summary cache: {e}")